@@ -0,0 +1,98 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from pytranscoder.media import MediaInfo, AudioTrack, SubtitleTrack
+
+#
+# Bump when the stored layout changes - older caches are discarded on open
+#
+SCHEMA_VERSION = 1
+
+
+def default_cache_dir() -> str:
+    """Per-user cache directory, ie. ~/.cache/pytranscoder"""
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'pytranscoder')
+
+
+class DetailsCache:
+    """Cache of parsed media details, keyed by absolute path and validated against modification time and size
+    so edited or replaced files are re-probed. Entries are stored as JSON, never pickled.
+    """
+
+    def __init__(self, db_path: Optional[str] = None, max_entries: int = 10000):
+        if db_path is None:
+            cache_dir = default_cache_dir()
+            os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+            db_path = os.path.join(cache_dir, 'details.db')
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._init_schema()
+
+    def _init_schema(self):
+        with self._lock, self._db:
+            version = self._db.execute('PRAGMA user_version').fetchone()[0]
+            if version != SCHEMA_VERSION:
+                self._db.execute('DROP TABLE IF EXISTS details')
+                self._db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            self._db.execute('CREATE TABLE IF NOT EXISTS details (path TEXT PRIMARY KEY, mtime_ns INTEGER, '
+                             'size INTEGER, updated REAL, info TEXT)')
+            # keep the cache bounded, dropping the oldest entries first
+            self._db.execute('DELETE FROM details WHERE path NOT IN '
+                             '(SELECT path FROM details ORDER BY updated DESC LIMIT ?)', (self.max_entries,))
+
+    def get(self, _path: str, st: os.stat_result) -> Optional[MediaInfo]:
+        """Return cached details for _path if the file is unchanged since they were stored, else None"""
+        try:
+            with self._lock:
+                row = self._db.execute('SELECT mtime_ns, size, info FROM details WHERE path = ?',
+                                       (os.path.abspath(_path),)).fetchone()
+            if row is None or row[0] != st.st_mtime_ns or row[1] != st.st_size:
+                return None
+            return _decode(_path, json.loads(row[2]))
+        except (sqlite3.Error, ValueError, KeyError, TypeError) as ex:
+            print('Unable to read media details cache - ' + str(ex))
+            return None
+
+    def put(self, _path: str, st: os.stat_result, info: MediaInfo):
+        try:
+            with self._lock, self._db:
+                self._db.execute('INSERT OR REPLACE INTO details VALUES (?, ?, ?, ?, ?)',
+                                 (os.path.abspath(_path), st.st_mtime_ns, st.st_size, time.time(),
+                                  json.dumps(_encode(info))))
+        except sqlite3.Error as ex:
+            print('Unable to update media details cache - ' + str(ex))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _encode(info: MediaInfo) -> dict:
+    return {
+        'vcodec': info.vcodec,
+        'stream': info.stream,
+        'res_height': info.res_height,
+        'res_width': info.res_width,
+        'runtime': info.runtime,
+        'filesize_mb': info.filesize_mb,
+        'fps': info.fps,
+        'colorspace': info.colorspace,
+        'audio': [[a.stream, a.lang, a.format, a.default] for a in info.audio],
+        'subtitle': [[s.stream, s.lang, s.default] for s in info.subtitle]
+    }
+
+
+def _decode(_path: str, data: dict) -> MediaInfo:
+    data['audio'] = [AudioTrack(*a) for a in data['audio']]
+    data['subtitle'] = [SubtitleTrack(*s) for s in data['subtitle']]
+    return MediaInfo(path=_path, **data)
@@ -694,7 +694,7 @@ class Cluster(Thread):
         self.hosts: List[ManagedHost] = list()
         self.config = config
         self.verbose = verbose
-        self.ffmpeg = FFmpeg(config.ffmpeg_path)
+        self.ffmpeg = FFmpeg(config.ffmpeg_path, config.details_cache())
         self.lock = Cluster.terminal_lock
         self.completed: List = list()
 
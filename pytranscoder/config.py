@@ -1,9 +1,11 @@
 import sys
 import os
+import sqlite3
 from typing import Dict, Any, Optional
 
 import yaml
 
+from pytranscoder.cache import DetailsCache
 from pytranscoder.media import MediaInfo
 from pytranscoder.profile import Profile
 from pytranscoder.rule import Rule
@@ -20,6 +22,7 @@ class ConfigFile:
 
         self.profiles = dict()
         self.rules = dict()
+        self._details_cache: Optional[DetailsCache] = None
         yml = None
         if configuration is not None:
             if isinstance(configuration, Dict):
@@ -51,6 +54,21 @@ class ConfigFile:
     def fls_path(self) -> str:
         return self.settings.get('fls_path', None)
 
+    def details_cache(self) -> Optional[DetailsCache]:
+        """Shared media details cache, or None unless enabled with "details_cache: yes" """
+        enabled = self.settings.get('details_cache', False)
+        if isinstance(enabled, str):
+            enabled = enabled.lower() == 'yes'
+        if not enabled:
+            return None
+        if self._details_cache is None:
+            try:
+                self._details_cache = DetailsCache()
+            except (OSError, sqlite3.Error) as ex:
+                print('Unable to open media details cache - ' + str(ex))
+                self.settings['details_cache'] = False
+        return self._details_cache
+
     def colorize(self) -> bool:
         return self.settings.get('colorize', 'no').lower() == 'yes'
 
@@ -10,6 +10,7 @@ from tempfile import gettempdir
 from typing import Dict, Any, Optional
 import json
 
+from pytranscoder.cache import DetailsCache
 from pytranscoder.media import MediaInfo
 
 status_re = re.compile(
@@ -20,21 +21,38 @@ _CHARSET: str = sys.getdefaultencoding()
 
 class FFmpeg:
 
-    def __init__(self, ffmpeg_path):
+    def __init__(self, ffmpeg_path, details_cache: Optional[DetailsCache] = None):
         self.ffmpeg = ffmpeg_path
+        self.details_cache = details_cache
         self.last_command = ''
         self.monitor_interval = 30
         self.log_path: PurePath = None
 
-    def fetch_details(self, _path: str) -> MediaInfo:
-        """Use ffmpeg to get media information
+    def fetch_details(self, _path: str) -> Optional[MediaInfo]:
+        """Use ffmpeg to get media information, reusing cached details if caching is enabled and the file is unchanged
 
         :param _path:   Absolute path to media file
-        :return:        Instance of MediaInfo
+        :return:        Instance of MediaInfo, or None if the file doesn't exist
         """
+        try:
+            st = os.stat(_path)
+        except OSError:
+            return None
+        if self.details_cache is None:
+            return self._probe_details(_path, st.st_size)
+
+        mi = self.details_cache.get(_path, st)
+        if mi is not None:
+            return mi
+        mi = self._probe_details(_path, st.st_size)
+        if mi.valid:
+            self.details_cache.put(_path, st, mi)
+        return mi
+
+    def _probe_details(self, _path: str, st_size: int) -> MediaInfo:
         with subprocess.Popen([self.ffmpeg, '-i', _path], stderr=subprocess.PIPE) as proc:
-            output = proc.stderr.read().decode(encoding='utf8')
-            mi = MediaInfo.parse_details(_path, output)
+            output = proc.stderr.read()
+            mi = MediaInfo.parse_details(_path, output, st_size)
             if mi.valid:
                 return mi
         # try falling back to ffprobe, if it exists
@@ -42,12 +60,12 @@ class FFmpeg:
             return self.fetch_details_ffprobe(_path)
         except Exception as ex:
             print("Unable to fallback to ffprobe - " + str(ex))
-            return MediaInfo(None)
+            return MediaInfo.invalid()
 
     def fetch_details_ffprobe(self, _path: str) -> MediaInfo:
         ffprobe_path = str(PurePath(self.ffmpeg).parent.joinpath('ffprobe'))
         if not os.path.exists(ffprobe_path):
-            return MediaInfo(None)
+            return MediaInfo.invalid()
 
         args = [ffprobe_path, '-v', '1', '-show_streams', '-print_format', 'json', '-i', _path]
         with subprocess.Popen(args, stdout=subprocess.PIPE) as proc:
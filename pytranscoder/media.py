@@ -1,8 +1,10 @@
 
 import os
 import re
-from datetime import timedelta
-from typing import Dict, Optional, List
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from sys import intern
+from typing import Optional, List, Tuple, Union
 
 from pytranscoder import verbose
 
@@ -10,37 +12,122 @@ from pytranscoder import verbose
 #                      re.DOTALL)
 from pytranscoder.profile import Profile
 
-video_dur = re.compile(r".*Duration: (\d+):(\d+):(\d+)", re.DOTALL)
-video_info = re.compile(r'.*Stream #0:(\d+)(?:\(\w+\))?: Video: (\w+).*, (yuv\w+)[(,].* (\d+)x(\d+).* (\d+)(\.\d.)? fps', re.DOTALL)
-audio_info = re.compile(r'^\s+Stream #0:(?P<stream>\d+)(\((?P<lang>\w+)\))?: Audio: (?P<format>\w+).*?(?P<default>\(default\))?$', re.MULTILINE)
-subtitle_info = re.compile(r'^\s+Stream #0:(?P<stream>\d+)(\((?P<lang>\w+)\))?: Subtitle:', re.MULTILINE)
+#
+# duration, video, audio and subtitle stream lines, matched in a single pass over the raw (bytes) ffmpeg output.
+# Every alternative starts with a literal so the scan can skip ahead to "Duration: " or "Stream #0:".
+#
+stream_info = re.compile(
+    rb'Duration: (?P<dur_hrs>\d+):(?P<dur_mins>\d+):(?P<dur_secs>\d+)'
+    rb'|Stream #0:(?P<stream>\d+)(?:\((?P<lang>\w+)\))?: (?:'
+    rb'(?P<video>Video: (?P<vcodec>\w+).*, (?P<colorspace>yuv\w+)[(,].* (?P<res_width>\d+)x(?P<res_height>\d+).* '
+    rb'(?P<fps>\d+)(?:\.\d.)? fps)'
+    rb'|(?P<audio>Audio: (?P<aformat>\w+).*?(?P<adefault>\(default\))?$)'
+    rb'|(?P<subtitle>Subtitle:))',
+    re.MULTILINE)
+
+
+_MB = 1 << 20
+
+numeric_predicates = frozenset({'res_height', 'res_width', 'runtime', 'filesize_mb', 'fps'})
+
+_numeric_value = re.compile(r'^\s*([<>]?)\s*(\d+(?:\.\d+)?)\s*(?:-\s*(\d+(?:\.\d+)?))?\s*$')
+_EQ, _LT, _GT, _RANGE = range(4)
+
+
+def _number(text: str) -> Union[int, float]:
+    return float(text) if '.' in text else int(text)
+
+
+@lru_cache(maxsize=None)
+def _parse_numeric(pred: str, value: str) -> Optional[Tuple[int, Union[int, float], Optional[Union[int, float]]]]:
+    """Parse a numeric rule criteria value into an (op, low, high) tuple.
+
+    Runtime values are given in minutes and converted to seconds here so the
+    comparison itself is a plain numeric test.
+
+    :param pred:    Predicate name the value belongs to
+    :param value:   Criteria value, ie. "720", "<500", ">29.97" or "30-65"
+    :return:        (op, low, high) tuple, or None if the value isn't a recognized form
+    :raises ValueError: on a malformed range expression
+    """
+    match = _numeric_value.match(value)
+    if match is None or (match.group(1) and match.group(3) is not None):
+        if '-' in value:
+            raise ValueError(value)
+        return None
+
+    scale = 60 if pred == 'runtime' else 1
+    op, low, high = match.groups()
+    low = _number(low) * scale
+    if high is not None:
+        return _RANGE, low, _number(high) * scale
+    if op == '<':
+        return _LT, low, None
+    if op == '>':
+        return _GT, low, None
+    return _EQ, low, None
+
+
+class AudioTrack:
+    __slots__ = ('stream', 'lang', 'format', 'default')
+
+    def __init__(self, stream: str, lang: str = 'und', format: Optional[str] = None, default: bool = False):
+        # pylint: disable=redefined-builtin
+        self.stream = stream
+        self.lang = lang
+        self.format = format
+        self.default = default
+
+    def __str__(self):
+        return f'{self.stream}:{self.lang}:{self.format}:{"default" if self.default else ""}'
+
+
+class SubtitleTrack:
+    __slots__ = ('stream', 'lang', 'default')
+
+    def __init__(self, stream: str, lang: str = 'und', default: bool = False):
+        self.stream = stream
+        self.lang = lang
+        self.default = default
+
+    def __str__(self):
+        return f'{self.stream}:{self.lang}:{"default" if self.default else ""}'
 
 
 class MediaInfo:
     # pylint: disable=too-many-instance-attributes
-
-    def __init__(self, info: Optional[Dict]):
-        self.valid = info is not None
-        if not self.valid:
-            return
-        self.path = info['path']
-        self.vcodec = info['vcodec']
-        self.stream = info['stream']
-        self.res_height = info['res_height']
-        self.res_width = info['res_width']
-        self.runtime = info['runtime']
-        self.filesize_mb = info['filesize_mb']
-        self.fps = info['fps']
-        self.colorspace = info['colorspace']
-        self.audio = info['audio']
-        self.subtitle = info['subtitle']
+    __slots__ = ('valid', 'path', 'vcodec', 'stream', 'res_height', 'res_width', 'runtime', 'filesize_mb', 'fps',
+                 'colorspace', 'audio', 'subtitle')
+
+    def __init__(self, *, path: str, vcodec: str, stream: str, res_height: int, res_width: int, runtime: int,
+                 filesize_mb: float, fps: int, colorspace: str, audio: List[AudioTrack], subtitle: List[SubtitleTrack]):
+        # pylint: disable=too-many-arguments
+        self.valid = True
+        self.path = path
+        self.vcodec = vcodec
+        self.stream = stream
+        self.res_height = res_height
+        self.res_width = res_width
+        self.runtime = runtime
+        self.filesize_mb = filesize_mb
+        self.fps = fps
+        self.colorspace = colorspace
+        self.audio = audio
+        self.subtitle = subtitle
+
+    @classmethod
+    def invalid(cls) -> 'MediaInfo':
+        """Placeholder for media that couldn't be probed; only the valid flag is set"""
+        info = cls.__new__(cls)
+        info.valid = False
+        return info
 
     def __str__(self):
-        runtime = "{:0>8}".format(str(timedelta(seconds=self.runtime)))
-        audios = [a['stream'] + ':' + a['lang'] + ':' + a['format'] + ':' + a['default'] for a in self.audio]
-        audio = '(' + ','.join(audios) + ')'
-        subs = [s['stream'] + ':' + s['lang'] + ':' + s['default'] for s in self.subtitle]
-        sub = '(' + ','.join(subs) + ')'
+        hrs, rem = divmod(self.runtime, 3600)
+        mins, secs = divmod(rem, 60)
+        runtime = f'{hrs:02d}:{mins:02d}:{secs:02d}'
+        audio = '(' + ','.join(map(str, self.audio)) + ')' if self.audio else '()'
+        sub = '(' + ','.join(map(str, self.subtitle)) + ')' if self.subtitle else '()'
         buf = f"MediaInfo: {self.path}, {self.filesize_mb}mb, {self.fps} fps, cs={self.colorspace}, {self.res_width}x{self.res_height}, {runtime}, c:v={self.vcodec}, audio={audio}, sub={sub}"
         return buf
 
@@ -48,45 +135,47 @@ class MediaInfo:
         return len(self.audio) > 1 or len(self.subtitle) > 1
 
     def _map_streams(self, stream_type: str, streams: List, excludes: list, includes: list, defl: str) -> list:
-        if excludes is None:
-            excludes = []
-        if not includes:
-            includes = None
+        excludes = frozenset(excludes) if excludes else frozenset()
+        includes = frozenset(includes) if includes else None
         seq_list = list()
-        mapped = list()
+        mapped_count = 0
+        default_idx = -1
         default_reassign = False
         for s in streams:
-            stream_lang = s.get('lang', 'none')
+            stream_lang = s.lang
             #
             # includes take precedence over excludes
             #
             if includes is not None and stream_lang not in includes:
-                if s.get('default', None) is not None:
+                if s.default:
                     default_reassign = True
                 continue
 
             if stream_lang in excludes:
-                if s.get('default', None) is not None:
+                if s.default:
                     default_reassign = True
                 continue
 
-            # if we got here, map the stream
-            mapped.append(s)
-            seq = s['stream']
-            seq_list.append('-map')
-            seq_list.append(f'0:{seq}')
+            # if we got here, map the stream, remembering the first one in the default language
+            if default_idx < 0 and stream_lang == defl:
+                default_idx = mapped_count
+            mapped_count += 1
+            seq_list += ('-map', f'0:{s.stream}')
 
         if default_reassign:
             if defl is None:
                 print('Warning: A default stream will be removed but no default language specified to replace it')
-            else:
-                for i, s in enumerate(mapped):
-                    if s.get('lang', None) == defl:
-                        seq_list.append(f'-disposition:{stream_type}:{i}')
-                        seq_list.append('default')
+            elif default_idx >= 0:
+                seq_list += (f'-disposition:{stream_type}:{default_idx}', 'default')
         return seq_list
 
     def ffmpeg_streams(self, profile: Profile) -> list:
+        #
+        # if no inclusions or exclusions just map everything
+        #
+        if not profile.has_stream_filters:
+            return ['-map', '0']
+
         excl_audio = profile.excluded_audio()
         excl_subtitle = profile.excluded_subtitles()
         incl_audio = profile.included_audio()
@@ -95,123 +184,92 @@ class MediaInfo:
         defl_audio = profile.default_audio()
         defl_subtitle = profile.default_subtitle()
 
-        if excl_audio is None:
-            excl_audio = []
-        if excl_subtitle is None:
-            excl_subtitle = []
-        #
-        # if no inclusions or exclusions just map everything
-        #
-        if len(incl_audio) == 0 and len(excl_audio) == 0 and len(incl_subtitle) == 0 and len(excl_subtitle) == 0:
-            return ['-map', '0']
-
-        seq_list = list()
-        seq_list.append('-map')
-        seq_list.append(f'0:{self.stream}')
+        seq_list = ['-map', f'0:{self.stream}']
         audio_streams = self._map_streams("a", self.audio, excl_audio, incl_audio, defl_audio)
         subtitle_streams = self._map_streams("s", self.subtitle, excl_subtitle, incl_subtitle, defl_subtitle)
         return seq_list + audio_streams + subtitle_streams
 
     def eval_numeric(self, rulename: str, pred: str, value: str) -> bool:
-        attr = self.__dict__.get(pred, None)
+        attr = getattr(self, pred) if pred in numeric_predicates else None
         if attr is None:
             print(f'Error: Rule "{rulename}" unknown attribute: {pred} ')
             raise ValueError(value)
 
-        if '-' in value:
-            # this is a range expression
-            parts = value.split('-')
-            if len(parts) != 2:
-                print(f'Error: Rule "{rulename}" bad range expression: {value} ')
-                raise ValueError(value)
-            rangelow, rangehigh = parts
-
-            if pred == 'runtime':
-                rangelow = str(int(rangelow) * 60)
-                rangehigh = str(int(rangehigh) * 60)
-
-            expr = f'{rangelow} <= {attr} <= {rangehigh}'
-
-        elif value.isnumeric():
-            # simple numeric equality test
-
-            if pred == 'runtime':
-                # convert to seconds
-                value = str(int(value) * 60)
-
-            expr = f'{attr} == {value}'
-
-        elif value[0] in '<>':
-            op = value[0]
-            value = value[1:]
-
-            if pred == 'runtime':
-                value = str(int(value) * 60)
-
-            expr = f'{attr} {op} {value}'
-
-        else:
+        try:
+            parsed = _parse_numeric(pred, value)
+        except ValueError:
+            print(f'Error: Rule "{rulename}" bad range expression: {value} ')
+            raise ValueError(value)
+        if parsed is None:
             print(f'Error: Rule "{rulename}" valid value: {value}')
             return False
 
-        if not eval(expr):
+        op, low, high = parsed
+        if op == _RANGE:
+            result = low <= attr <= high
+        elif op == _EQ:
+            result = attr == low
+        elif op == _LT:
+            result = attr < low
+        else:
+            result = attr > low
+
+        if not result:
             if verbose:
                 print(f'  >> predicate {pred} ("{value}") did not match {attr}')
             return False
         return True
 
     @staticmethod
-    def parse_details(_path, output):
-
-        match1 = video_dur.match(output)
-        if match1 is None or len(match1.groups()) < 3:
-            print(f'>>>> regex match on video stream data failed: ffmpeg -i {_path}')
-            return MediaInfo(None)
-
-        match2 = video_info.match(output)
-        if match2 is None or len(match2.groups()) < 5:
-            print(f'>>>> regex match on video stream data failed: ffmpeg -i {_path}')
-            return MediaInfo(None)
-
+    def parse_details(_path, output, st_size: Optional[int] = None):
+        if isinstance(output, str):
+            output = output.encode('utf8')
+        dur_match = None
+        video_match = None
         audio_tracks = list()
-        for audio_match in audio_info.finditer(output):
-            ainfo = audio_match.groupdict()
-            if ainfo['lang'] is None:
-                ainfo['lang'] = 'und'
-            audio_tracks.append(ainfo)
-
         subtitle_tracks = list()
-        for subt_match in subtitle_info.finditer(output):
-            sinfo = subt_match.groupdict()
-            if sinfo['lang'] is None:
-                sinfo['lang'] = 'und'
-            subtitle_tracks.append(sinfo)
-
-        _dur_hrs, _dur_mins, _dur_secs = match1.group(1, 2, 3)
-        _id, _codec, _colorspace, _res_width, _res_height, fps = match2.group(1, 2, 3, 4, 5, 6)
-        filesize = os.path.getsize(_path) / (1024 * 1024)
-
-        minfo = {
-            'path': _path,
-            'vcodec': _codec,
-            'stream': _id,
-            'res_width': int(_res_width),
-            'res_height': int(_res_height),
-            'runtime': (int(_dur_hrs) * 3600) + (int(_dur_mins) * 60) + int(_dur_secs),
-            'filesize_mb': filesize,
-            'fps': int(fps),
-            'colorspace': _colorspace,
-            'audio': audio_tracks,
-            'subtitle': subtitle_tracks
-        }
-        return MediaInfo(minfo)
+        for match in stream_info.finditer(output):
+            kind = match.lastgroup
+            if kind == 'audio':
+                stream, lang, fmt, default = match.group('stream', 'lang', 'aformat', 'adefault')
+                audio_tracks.append(AudioTrack(stream.decode('ascii'), intern((lang or b'und').decode('ascii')),
+                                               intern(fmt.decode('ascii')), default is not None))
+            elif kind == 'subtitle':
+                stream, lang = match.group('stream', 'lang')
+                subtitle_tracks.append(SubtitleTrack(stream.decode('ascii'), intern((lang or b'und').decode('ascii'))))
+            elif kind == 'video':
+                if video_match is None:
+                    video_match = match
+            elif dur_match is None:
+                dur_match = match
+
+        if dur_match is None or video_match is None:
+            print(f'>>>> regex match on video stream data failed: ffmpeg -i {_path}')
+            return MediaInfo.invalid()
+
+        _dur_hrs, _dur_mins, _dur_secs = dur_match.group('dur_hrs', 'dur_mins', 'dur_secs')
+        _id, _codec, _colorspace, _res_width, _res_height, fps = video_match.group(
+            'stream', 'vcodec', 'colorspace', 'res_width', 'res_height', 'fps')
+        if st_size is None:
+            st_size = os.path.getsize(_path)
+
+        return MediaInfo(path=_path,
+                         vcodec=intern(_codec.decode('ascii')),
+                         stream=_id.decode('ascii'),
+                         res_width=int(_res_width),
+                         res_height=int(_res_height),
+                         runtime=(int(_dur_hrs) * 3600) + (int(_dur_mins) * 60) + int(_dur_secs),
+                         filesize_mb=st_size / _MB,
+                         fps=int(fps),
+                         colorspace=intern(_colorspace.decode('ascii')),
+                         audio=audio_tracks,
+                         subtitle=subtitle_tracks)
 
     @staticmethod
     def parse_details_json(_path, info):
-        minone = MediaInfo(None)
-        minfo = { 'audio': [], 'subtitle': []}
+        minfo = {'audio': [], 'subtitle': []}
         if 'streams' not in info:
-            return minone
+            return MediaInfo.invalid()
         for stream in info['streams']:
             if stream['codec_type'] == 'video':
                 minfo['path'] = _path
@@ -219,10 +277,10 @@ class MediaInfo:
                 minfo['stream'] = str(stream['index'])
                 minfo['res_width'] = stream['width']
                 minfo['res_height'] = stream['height']
-                minfo['filesize_mb'] = os.path.getsize(_path) / (1024 * 1024)
+                minfo['filesize_mb'] = os.path.getsize(_path) / _MB
                 fr_parts = stream['r_frame_rate'].split('/')
                 fr = int(int(fr_parts[0]) / int(fr_parts[1]))
-                minfo['fps'] = str(fr)
+                minfo['fps'] = fr
                 minfo['colorspace'] = stream['pix_fmt']
                 if 'duration' in stream:
                     minfo['runtime'] = int(float(stream['duration']))
@@ -235,42 +293,36 @@ class MediaInfo:
                                 minfo['runtime'] = duration
                                 break
 
-            elif stream['codec_type'] == 'audio':
-                audio = dict()
-                audio['stream'] = str(stream['index'])
-                audio['format'] = stream['codec_name']
-                audio['default'] = 0
-                if 'disposition' in stream:
-                    if 'default' in stream['disposition']:
-                        audio['default'] = stream['disposition']['default']
+            elif stream['codec_type'] in ('audio', 'subrip'):
+                default = bool(stream.get('disposition', {}).get('default', 0))
+                lang = 'und'
                 if 'tags' in stream:
                     if 'language' in stream['tags']:
-                        audio['lang'] = stream['tags']['language']
+                        lang = stream['tags']['language']
                     else:
                         # derive the language
                         for name, value in stream['tags'].items():
                             if name[0:9] == 'DURATION-':
                                 lang = name[9:]
-                                audio['lang'] = lang
                                 break
-                minfo['audio'].append(audio)
-            elif stream['codec_type'] == 'subrip':
-                sub = dict()
-                sub['stream'] = str(stream['index'])
-                sub['format'] = stream['codec_name']
-                sub['default'] = 0
-                if 'disposition' in stream:
-                    if 'default' in stream['disposition']:
-                        sub['default'] = stream['disposition']['default']
-                if 'tags' in stream:
-                    if 'language' in stream['tags']:
-                        sub['lang'] = stream['tags']['language']
-                    else:
-                        # derive the language
-                        for name, value in stream['tags'].items():
-                            if name[0:9] == 'DURATION-':
-                                lang = name[9:]
-                                sub['lang'] = lang
-                                break
-                minfo['subtitle'].append(sub)
-        return MediaInfo(minfo)
+                if stream['codec_type'] == 'audio':
+                    minfo['audio'].append(AudioTrack(str(stream['index']), lang, stream['codec_name'], default))
+                else:
+                    minfo['subtitle'].append(SubtitleTrack(str(stream['index']), lang, default))
+        if 'vcodec' not in minfo:
+            return MediaInfo.invalid()
+        return MediaInfo(**minfo)
+
+
+def parse_many(pairs: List[Tuple[str, bytes]], max_workers: Optional[int] = None) -> List[MediaInfo]:
+    """Parse a batch of ffmpeg outputs across worker processes
+
+    :param pairs:       List of (path, ffmpeg output) tuples
+    :param max_workers: Number of worker processes, defaults to the cpu count
+    :return:            List of MediaInfo, in the same order as pairs
+    """
+    if len(pairs) < 2:
+        return [MediaInfo.parse_details(_path, output) for _path, output in pairs]
+    paths, outputs = zip(*pairs)
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(MediaInfo.parse_details, paths, outputs))
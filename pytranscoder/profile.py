@@ -67,6 +67,7 @@ class Profile:
     def __init__(self, name: str, profile: Optional[Dict] = None):
         self.profile: Dict[str, Any] = profile
         self.name = name
+        self._has_stream_filters: Optional[bool] = None
 
         if not profile:
             self.profile: Dict[str, Any] = dict()
@@ -160,8 +161,17 @@ class Profile:
             else:
                 self.profile[k] = v
 
+        # included audio/subtitle sections may add filters
+        self._has_stream_filters = None
         return self
 
+    @property
+    def has_stream_filters(self) -> bool:
+        if self._has_stream_filters is None:
+            self._has_stream_filters = bool(self.excluded_audio() or self.included_audio() or
+                                            self.excluded_subtitles() or self.included_subtitles())
+        return self._has_stream_filters
+
     def included_audio(self) -> list:
         audio_section = self.profile.get('audio')
         if audio_section is None:
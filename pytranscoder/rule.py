@@ -2,10 +2,9 @@ import re
 from typing import Dict
 
 from pytranscoder import verbose
-from pytranscoder.media import MediaInfo
+from pytranscoder.media import MediaInfo, numeric_predicates
 
-valid_predicates = ['vcodec', 'res_height', 'res_width', 'runtime', 'filesize_mb', 'fps', 'path']
-numeric_predicates = ['res_height', 'res_width', 'runtime', 'filesize_mb', 'fps']
+valid_predicates = numeric_predicates | {'vcodec', 'path'}
 
 
 class Rule:
@@ -18,6 +17,10 @@ class Rule:
         self.profile = rule['profile']
         if 'criteria' in rule:
             self.criteria = rule['criteria']
+            for pred in self.criteria:
+                if pred not in valid_predicates:
+                    print(f'Invalid predicate {pred} in rule {self.name}')
+                    exit(1)
         else:
             self.criteria = None
 
@@ -36,9 +39,6 @@ class Rule:
 
         for pred, value in self.criteria.items():
             inverted = False
-            if pred not in valid_predicates:
-                print(f'Invalid predicate {pred} in rule {self.name}')
-                exit(1)
             if isinstance(value, str) and len(value) > 1 and value[0] == '!':
                 inverted = True
                 value = value[1:]
@@ -47,7 +47,7 @@ class QueueThread(Thread):
         self.queue = queue
         self.config = configfile
         self._manager = manager
-        self.ffmpeg = FFmpeg(self.config.ffmpeg_path)
+        self.ffmpeg = FFmpeg(self.config.ffmpeg_path, self.config.details_cache())
 
     @property
     def lock(self):
@@ -166,7 +166,7 @@ class LocalHost:
     def __init__(self, configfile: ConfigFile):
         self.queues = dict()
         self.configfile = configfile
-        self.ffmpeg = FFmpeg(self.configfile.ffmpeg_path)
+        self.ffmpeg = FFmpeg(self.configfile.ffmpeg_path, self.configfile.details_cache())
         #
         # initialize the queues
         #
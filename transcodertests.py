@@ -1,15 +1,19 @@
 
 import unittest
 import os
+import sqlite3
+import tempfile
 from typing import Dict
 from unittest import mock
 
 from pytranscoder import transcode
+from pytranscoder.cache import DetailsCache, SCHEMA_VERSION
 from pytranscoder.cluster import RemoteHostProperties, Cluster, StreamingManagedHost
 from pytranscoder.config import ConfigFile
 from pytranscoder.ffmpeg import status_re, FFmpeg
-from pytranscoder.media import MediaInfo
+from pytranscoder.media import MediaInfo, AudioTrack, parse_many
 from pytranscoder.profile import Profile
+from pytranscoder.rule import Rule
 from pytranscoder.transcode import LocalHost
 from pytranscoder.utils import files_from_file, get_local_os_type, calculate_progress, dump_stats, is_exceeded_threshold
 
@@ -19,23 +23,12 @@ class TranscoderTests(unittest.TestCase):
     @staticmethod
     def make_media(path, vcodec, res_width, res_height, runtime, source_size, fps, colorspace,
                    audio, subtitle) -> MediaInfo:
-        info = {
-            'path': path,
-            'vcodec': vcodec,
-            'stream': 0,
-            'res_width': res_width,
-            'res_height': res_height,
-            'runtime': runtime,
-            'filesize_mb': source_size,
-            'fps': fps,
-            'colorspace': colorspace,
-            'audio': audio,
-            'subtitle': subtitle
-        }
-        return MediaInfo(info)
+        return MediaInfo(path=path, vcodec=vcodec, stream=0, res_width=res_width, res_height=res_height,
+                         runtime=runtime, filesize_mb=source_size, fps=fps, colorspace=colorspace,
+                         audio=audio, subtitle=subtitle)
 
     def test_stream_map_all(self):
-        with open('tests/ffmpeg3.out', 'r') as ff:
+        with open('tests/ffmpeg3.out', 'rb') as ff:
             info = MediaInfo.parse_details('/dev/null', ff.read())
             setup = ConfigFile(self.get_setup())
             p = setup.get_profile('qsv')
@@ -43,7 +36,7 @@ class TranscoderTests(unittest.TestCase):
             self.assertEqual(len(streams), 2, 'expected -map 0')
 
     def test_stream_exclude(self):
-        with open('tests/ffmpeg3.out', 'r') as ff:
+        with open('tests/ffmpeg3.out', 'rb') as ff:
             info = MediaInfo.parse_details('/dev/null', ff.read())
             setup = ConfigFile(self.get_setup())
             p = setup.get_profile('excl_test_1')
@@ -51,12 +44,23 @@ class TranscoderTests(unittest.TestCase):
             self.assertEqual(len(streams), 12, 'expected 6 streams (12 elements)')
 
     def test_stream_reassign_default(self):
-        with open('tests/ffmpeg4.out', 'r') as ff:
+        with open('tests/ffmpeg4.out', 'rb') as ff:
             info = MediaInfo.parse_details('/dev/null', ff.read())
             setup = ConfigFile(self.get_setup())
             p = setup.get_profile('excl_test_2')
             streams = info.ffmpeg_streams(p)
             self.assertEqual(len(streams), 8, 'expected 4 streams (8 elements)')
+            self.assertEqual(streams, ['-map', '0:0', '-map', '0:1', '-disposition:a:0', 'default', '-map', '0:3'])
+
+    def test_stream_reassign_default_first_match(self):
+        info = TranscoderTests.make_media(None, None, None, 720, 45, 3000, 25, None,
+                                          [AudioTrack('1', 'eng', default=True), AudioTrack('2', 'chi'),
+                                           AudioTrack('3', 'chi')], [])
+        setup = ConfigFile(self.get_setup())
+        p = setup.get_profile('excl_test_2')
+        streams = info.ffmpeg_streams(p)
+        # only the first remaining stream in the default language becomes the default
+        self.assertEqual(streams, ['-map', '0:0', '-map', '0:2', '-map', '0:3', '-disposition:a:0', 'default'])
 
 #    def test_hook(self):
 #        transcode.manage_hook("rule_hook_ex.py")
@@ -80,6 +84,18 @@ class TranscoderTests(unittest.TestCase):
         expected = sorted(["three", "four", "five", "seven"])
         self.assertEqual(op2, expected, "Unexpected input_options merger")
 
+    def test_profile_include_stream_filters(self):
+        with open('tests/ffmpeg3.out', 'rb') as ff:
+            info = MediaInfo.parse_details('/dev/null', ff.read())
+        parent = Profile('parent', {'audio': {'exclude_languages': ['und'], 'default_language': 'eng'}})
+        child = Profile('child', {'output_options': ['-c:v copy']})
+        self.assertFalse(child.has_stream_filters)
+        self.assertEqual(info.ffmpeg_streams(child), ['-map', '0'])
+        child.include(parent)
+        self.assertTrue(child.has_stream_filters, 'expected include() to reset the cached flag')
+        self.assertNotEqual(info.ffmpeg_streams(child), ['-map', '0'])
+        self.assertNotIn('0:2', info.ffmpeg_streams(child))
+
     def test_progress(self):
         info = TranscoderTests.make_media(None, None, None, 1080, 90 * 60, 2300, 25, None, [], [])
         stats = {'size': 1225360000, 'time': 50 * 60}
@@ -107,7 +123,7 @@ class TranscoderTests(unittest.TestCase):
         os.remove(testpath)
 
     def test_mediainfo(self):
-        with open('tests/ffmpeg.out', 'r') as ff:
+        with open('tests/ffmpeg.out', 'rb') as ff:
             info = MediaInfo.parse_details('/dev/null', ff.read())
             self.assertIsNotNone(info)
             self.assertEqual(info.vcodec, 'h264')
@@ -117,8 +133,16 @@ class TranscoderTests(unittest.TestCase):
             self.assertEqual(info.path, '/dev/null')
             self.assertEqual(info.colorspace, 'yuv420p')
 
+    def test_mediainfo_known_size(self):
+        with open('tests/ffmpeg.out', 'rb') as ff:
+            info = MediaInfo.parse_details('/dev/null', ff.read(), st_size=512 * 1024)
+            self.assertEqual(info.filesize_mb, 0.5)
+            done, comp = calculate_progress(info, {'size': 100 * 1024, 'time': info.runtime // 2})
+            self.assertEqual(done, 50)
+            self.assertEqual(comp, 60)
+
     def test_mediainfo2(self):
-        with open('tests/ffmpeg2.out', 'r') as ff:
+        with open('tests/ffmpeg2.out', 'rb') as ff:
             info = MediaInfo.parse_details('/dev/null', ff.read())
             self.assertIsNotNone(info)
             self.assertEqual(info.vcodec, 'h264')
@@ -129,7 +153,7 @@ class TranscoderTests(unittest.TestCase):
             self.assertEqual(info.colorspace, 'yuv420p')
 
     def test_mediainfo3(self):
-        with open('tests/ffmpeg3.out', 'r') as ff:
+        with open('tests/ffmpeg3.out', 'rb') as ff:
             info = MediaInfo.parse_details('/dev/null', ff.read())
             self.assertIsNotNone(info)
             self.assertEqual(info.vcodec, 'hevc')
@@ -139,10 +163,22 @@ class TranscoderTests(unittest.TestCase):
             self.assertEqual(info.path, '/dev/null')
             self.assertEqual(info.colorspace, 'yuv420p10le')
 
+    def test_mediainfo_str(self):
+        info = TranscoderTests.make_media('/dev/null', 'h264', 1920, 1080, 101 * 3600 + 62, 2300, 24, 'yuv420p', [], [])
+        self.assertIn(', 101:01:02, ', str(info))
+
+    def test_parse_many(self):
+        pairs = list()
+        for name in ['tests/ffmpeg.out', 'tests/ffmpeg2.out', 'tests/ffmpeg3.out']:
+            with open(name, 'rb') as ff:
+                pairs.append(('/dev/null', ff.read()))
+        infos = parse_many(pairs, max_workers=2)
+        self.assertEqual([info.res_width for info in infos], [1280, 1920, 3840])
+        self.assertEqual(infos[2].audio[0].lang, 'eng')
+
     def test_automap_include(self):
         info = TranscoderTests.make_media(None, None, None, 720, 45, 3000, 25, None,
-                                          [{'lang': 'eng', 'stream': '1'},
-                                           {'lang': 'ger', 'stream': '2', 'default': True}], [])
+                                          [AudioTrack('1', 'eng'), AudioTrack('2', 'ger', default=True)], [])
         setup = ConfigFile(self.get_setup())
         p = setup.get_profile('hevc_cuda')
         options = info.ffmpeg_streams(p)
@@ -150,8 +186,7 @@ class TranscoderTests(unittest.TestCase):
 
     def test_include_overides(self):
         info = TranscoderTests.make_media(None, None, None, 720, 45, 3000, 25, None,
-                                          [{'lang': 'eng', 'stream': '1'},
-                                           {'lang': 'ger', 'stream': '2', 'default': True}], [])
+                                          [AudioTrack('1', 'eng'), AudioTrack('2', 'ger', default=True)], [])
         setup = ConfigFile(self.get_setup())
         p = setup.get_profile('hevc_cuda_8bit')
         self.assertEqual(p.threshold, 0, 'Threshold should be 0')
@@ -168,7 +203,7 @@ class TranscoderTests(unittest.TestCase):
         self.assertEqual(rule.name, 'default')
 
     def test_skip_profile(self):
-        with open('tests/ffmpeg.out', 'r') as ff:
+        with open('tests/ffmpeg.out', 'rb') as ff:
             info = MediaInfo.parse_details('/dev/null', ff.read())
             info.filesize_mb = 499
             config = ConfigFile(self.get_setup())
@@ -182,6 +217,120 @@ class TranscoderTests(unittest.TestCase):
         rule = config.match_rule(info)
         self.assertIsNotNone(rule, 'Expected a matched profile')
 
+    def test_eval_numeric(self):
+        info = TranscoderTests.make_media(None, None, 1920, 1080, 45 * 60, 2300, 24, None, [], [])
+        self.assertTrue(info.eval_numeric('t', 'res_height', '1080'))
+        self.assertTrue(info.eval_numeric('t', 'res_height', '720-1081'))
+        self.assertTrue(info.eval_numeric('t', 'runtime', '<60'))
+        self.assertFalse(info.eval_numeric('t', 'runtime', '>60'))
+        self.assertTrue(info.eval_numeric('t', 'runtime', '> 30'))
+        self.assertTrue(info.eval_numeric('t', 'runtime', '<60 '))
+        self.assertTrue(info.eval_numeric('t', 'res_height', ' 720 - 1081 '))
+        self.assertTrue(info.eval_numeric('t', 'res_height', ' 1080'))
+        self.assertFalse(info.eval_numeric('t', 'fps', 'abc'))
+        with self.assertRaises(ValueError):
+            info.eval_numeric('t', 'fps', '1-2-3')
+
+    def test_eval_numeric_fractional_attribute(self):
+        info = TranscoderTests.make_media(None, None, 1920, 1080, 45 * 60, 500.5, 24, None, [], [])
+        self.assertTrue(info.eval_numeric('t', 'filesize_mb', '>500'))
+        self.assertFalse(info.eval_numeric('t', 'filesize_mb', '400-500'))
+
+    def test_eval_numeric_decimal_criteria(self):
+        info = TranscoderTests.make_media(None, None, 1920, 1080, 45 * 60, 500.5, 30, None, [], [])
+        self.assertTrue(info.eval_numeric('t', 'fps', '>29.97'))
+        self.assertFalse(info.eval_numeric('t', 'fps', '<29.97'))
+        self.assertTrue(info.eval_numeric('t', 'filesize_mb', '<500.6'))
+        self.assertTrue(info.eval_numeric('t', 'filesize_mb', '500.5'))
+        self.assertTrue(info.eval_numeric('t', 'filesize_mb', '500.1 - 500.9'))
+        self.assertTrue(info.eval_numeric('t', 'runtime', '44.5-45.5'))
+
+    def test_rule_match_ffprobe_details(self):
+        details = {'streams': [
+            {'codec_type': 'video', 'codec_name': 'h264', 'index': 0, 'width': 1920, 'height': 1080,
+             'r_frame_rate': '24000/1001', 'pix_fmt': 'yuv420p', 'duration': '3000.5'},
+            {'codec_type': 'audio', 'codec_name': 'aac', 'index': 1, 'disposition': {'default': 1},
+             'tags': {'language': 'eng'}}
+        ]}
+        info = MediaInfo.parse_details_json('/dev/null', details)
+        self.assertTrue(info.valid)
+        self.assertTrue(info.eval_numeric('t', 'fps', '23'))
+        self.assertTrue(info.eval_numeric('t', 'fps', '<30'))
+        rule = Rule('fps rule', {'profile': 'qsv', 'criteria': {'fps': '<30', 'runtime': '45-55'}})
+        self.assertEqual(rule.match(info), ('qsv', 'fps rule'))
+
+    def test_details_cache(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            media = os.path.join(tmpdir, 'media.mkv')
+            with open(media, 'wb') as f:
+                f.write(b'x' * 100)
+            with open('tests/ffmpeg3.out', 'rb') as ff:
+                info = MediaInfo.parse_details(media, ff.read())
+            cache = DetailsCache(os.path.join(tmpdir, 'details.db'))
+            st = os.stat(media)
+
+            # miss on an empty cache
+            self.assertIsNone(cache.get(media, st))
+
+            # hit returns the stored details, with the caller's path
+            cache.put(media, st, info)
+            cached = cache.get(os.path.join(tmpdir, '.', 'media.mkv'), st)
+            self.assertIsNotNone(cached)
+            self.assertEqual(str(cached).split(', ', 1)[1], str(info).split(', ', 1)[1])
+            self.assertEqual(cached.path, os.path.join(tmpdir, '.', 'media.mkv'))
+            self.assertEqual(cached.audio[0].lang, 'eng')
+            self.assertTrue(cached.audio[0].default)
+
+            # modified or replaced files are invalidated
+            os.utime(media, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+            self.assertIsNone(cache.get(media, os.stat(media)))
+            with open(media, 'ab') as f:
+                f.write(b'x')
+            os.utime(media, ns=(st.st_atime_ns, st.st_mtime_ns))
+            self.assertIsNone(cache.get(media, os.stat(media)))
+            cache.close()
+
+    def test_details_cache_schema_version(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_path = os.path.join(tmpdir, 'details.db')
+            with open('tests/ffmpeg.out', 'rb') as ff:
+                info = MediaInfo.parse_details('/dev/null', ff.read())
+            cache = DetailsCache(db_path)
+            st = os.stat('/dev/null')
+            cache.put('/dev/null', st, info)
+            cache.close()
+
+            db = sqlite3.connect(db_path)
+            db.execute(f'PRAGMA user_version = {SCHEMA_VERSION - 1}')
+            db.close()
+            cache = DetailsCache(db_path)
+            self.assertIsNone(cache.get('/dev/null', st), 'expected stale schema to be discarded')
+            cache.close()
+
+    @mock.patch.object(FFmpeg, '_probe_details')
+    def test_fetch_details_cached(self, mock_probe):
+        with open('tests/ffmpeg.out', 'rb') as ff:
+            mock_probe.return_value = MediaInfo.parse_details('/dev/null', ff.read())
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = DetailsCache(os.path.join(tmpdir, 'details.db'))
+            ffmpeg = FFmpeg('/usr/bin/ffmpeg', cache)
+            self.assertEqual(ffmpeg.fetch_details('/dev/null').vcodec, 'h264')
+            self.assertEqual(ffmpeg.fetch_details('/dev/null').vcodec, 'h264')
+            self.assertEqual(mock_probe.call_count, 1, 'expected second lookup to hit the cache')
+            cache.close()
+
+        # disabled unless configured
+        self.assertIsNone(ConfigFile(self.get_setup()).details_cache())
+        self.assertIsNone(FFmpeg('/usr/bin/ffmpeg').details_cache)
+
+    def test_rule_invalid_predicate(self):
+        setup = self.get_setup()
+        setup['rules']['typo'] = {'profile': 'qsv', 'criteria': {'res_hieght': '<500'}}
+        with mock.patch('builtins.print'), self.assertRaises(SystemExit):
+            ConfigFile(setup)
+        with mock.patch('builtins.print'), self.assertRaises(SystemExit):
+            Rule('typo', {'profile': 'qsv', 'criteria': {'runtime': '>90', 'bogus': '1'}})
+
     def test_loc_os(self):
         self.assertEqual(get_local_os_type(), 'linux', 'Expected linux as os type')
 